@@ -1,7 +1,22 @@
+import io
+import logging
 import requests
-import xml.etree.ElementTree as ET
+import urllib3
 import os
-import re
+import sys
+
+# lxml (libxml2) parses much faster than the stdlib ElementTree and exposes the
+# same API; fall back to the stdlib parser when it is not installed.
+# With lxml, iterparse also filters events down to product items inside libxml2,
+# so Python never sees the end events of the ~20 fields nested in every item.
+try:
+    from lxml import etree as ET
+    ITEM_EVENT_FILTER = {'tag': ('{*}item', '{*}entry')}
+except ImportError:
+    import xml.etree.ElementTree as ET
+    ITEM_EVENT_FILTER = {}
+
+log = logging.getLogger('street_shoes')
 
 # --- Configuration ---
 # FIX: Hardcoded the URL to bypass environment variable errors as requested.
@@ -9,154 +24,180 @@ XML_FEED_URL = "https://backend.ballzy.eu/et/amfeed/feed/download?id=102&file=cr
 OUTPUT_FILENAME = "street_shoes_product_names.txt"
 TARGET_CATEGORY_PART = "Street Shoes"
 
+# Feed downloads are cached on disk (feed_cache.sqlite) for an hour, so other scripts
+# in the same workflow run reuse the download instead of fetching the feed again.
+# Expired entries are revalidated with ETag/Last-Modified when the server sends them.
+try:
+    from requests_cache import CachedSession
+    SESSION = CachedSession('feed_cache', expire_after=3600)
+    SESSION_CACHES = True
+except ImportError:
+    SESSION = requests.Session()
+    SESSION_CACHES = False
+
 # Define the Google Merchant Center Namespace (for g: elements)
 NAMESPACES = {'g': 'http://base.google.com/ns/1.0'}
 ET.register_namespace('g', NAMESPACES['g']) 
 
+# Resolved ('{uri}local') tags of the item fields we read
+TAG_CATEGORY = f"{{{NAMESPACES['g']}}}google_product_category"
+TAG_TITLE = f"{{{NAMESPACES['g']}}}title"
+TAG_LINK = f"{{{NAMESPACES['g']}}}link"
+TAG_LIFESTYLE = 'custom_label_0'
+TAG_BRAND = 'custom_label_3'
+
+# Gender markers stripped from the start or end of titles to reduce duplicates:
+# 'w' (nike w air max), 'wmns' (jordan wmns air force 1), "women's", 'womens',
+# and 'gs' (Grade School / Youth sizing often appears as a redundant suffix).
+# Titles are lowercased and split into words first, so a set lookup per edge word is enough.
+GENDER_TOKENS = frozenset({'w', 'wmns', "women's", 'womens', 'gs'})
+
 def fetch_xml_data(url):
-    """Fetches the XML data from the given URL and prints debug info."""
+    """Opens the XML feed at the given URL as a file-like body and prints debug info."""
     # The URL check is removed since the URL is hardcoded.
-    print(f"DEBUG: Attempting to fetch XML feed from: {url}")
+    log.debug("Attempting to fetch XML feed from: %s", url)
     try:
-        response = requests.get(url, timeout=45) 
+        # stream=True: without requests-cache the body is read by the parser as it arrives
+        response = SESSION.get(url, timeout=45, stream=True) 
         response.raise_for_status() 
-        print(f"DEBUG: Fetch successful. Content length: {len(response.content)} bytes.")
-        return response.content
+        log.debug("Fetch successful. Content length: %s bytes.", response.headers.get('Content-Length', 'unknown'))
+        # requests-cache downloads and decodes the whole body itself to store it, and a
+        # gzip response.raw cannot be decoded a second time: parse that stored copy instead
+        if SESSION_CACHES:
+            return io.BytesIO(response.content)
+        response.raw.decode_content = True
+        return response.raw
     except requests.exceptions.RequestException as e:
-        print(f"FATAL ERROR: Failed to fetch data: {e}")
+        log.error("Failed to fetch data: %s", e)
         return None
 
-def extract_street_shoes_list(xml_content):
-    """Parses XML and extracts brand, title, and G:LINK for products matching the category."""
-    if not xml_content:
-        return []
-
-    try:
-        root = ET.fromstring(xml_content)
-        print(f"DEBUG: XML Parsed successfully. Root tag is: {root.tag}")
-    except ET.ParseError as e:
-        print(f"FATAL ERROR: Error parsing XML: {e}")
+def iter_feed_items(context):
+    """Yields each product <item>/<entry> from an iterparse context, freeing it once processed."""
+    for _, elem in context:
+        tag = elem.tag
+        if tag in ('item', 'entry') or tag.endswith(('}item', '}entry')):
+            yield elem
+            elem.clear()
+            # lxml only: also drop the already processed siblings from the parent
+            if hasattr(elem, 'getprevious'):
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+def extract_street_shoes_list(xml_stream):
+    """Parses the XML stream and extracts brand, title, and G:LINK for products matching the category."""
+    if not xml_stream:
         return []
 
-    # --- Namespace Discovery for Product Items (RSS/Atom) ---
-    product_tag_name = 'item' 
-    namespace_match = re.match(r'\{(.+)\}', root.tag)
-    
-    if namespace_match:
-        default_namespace = namespace_match.group(1)
-        qualified_item = f"{{{default_namespace}}}item"
-        qualified_entry = f"{{{default_namespace}}}entry"
-        
-        items = root.findall(f'.//{qualified_item}') 
-        if not items:
-            items = root.findall(f'.//{qualified_entry}')
-        
-        print(f"DEBUG: Using qualified search. Default namespace: {default_namespace}. Found {len(items)} items.")
-    else:
-        # Fallback to simple find (no namespaces)
-        items = root.findall('.//item') or root.findall('.//entry')
-        print(f"DEBUG: Using simple search (no namespace prefix). Found {len(items)} items.")
-
-    # --- Check for successful item discovery ---
-    if not items:
-        print("WARNING: Could not find any product items using common paths (./item, ./entry, or qualified names).")
-        print("DEBUG: Root Element Children (Snippet):")
-        for i, child in enumerate(root):
-            if i < 5:
-                print(f"  Child {i+1} Tag: {child.tag}")
-            else:
-                break
-        return []
-        
-    print(f"DEBUG: Found {len(items)} product items to process.")
-    
     # Stores {product_string: raw_link}
     unique_product_data = {} 
     matched_count = 0
+    item_count = 0
+
+    # Bind the module constants used per item to locals (LOAD_FAST instead of LOAD_GLOBAL)
+    target_category = TARGET_CATEGORY_PART
+    tag_category, tag_lifestyle = TAG_CATEGORY, TAG_LIFESTYLE
+    tag_brand, tag_title, tag_link = TAG_BRAND, TAG_TITLE, TAG_LINK
+    gender_tokens = GENDER_TOKENS
+
+    # Brands come from a small fixed set: normalize each distinct raw brand once and
+    # intern the result, so every matched item shares one string object per brand.
+    # Maps raw brand -> (normalized brand, its words for the prefix check)
+    normalized_brands = {}
     
-    # Define prefixes/suffixes to strip from titles to reduce duplicates (case-insensitive)
-    GENDER_STRIPPERS = [
-        r'\bw\b',       # 'w ' (e.g., nike w air max)
-        r'\bwmns\b',    # 'wmns ' (e.g., jordan wmns air force 1)
-        r"women's\b",
-        r"womens\b",
-        r"gs\b",        # Grade School / Youth sizing often appears as a redundant suffix
-    ]
-    # Compile a regex pattern to efficiently check and replace these prefixes/suffixes
-    GENDER_PREFIX_PATTERN = re.compile(r'^\s*(' + '|'.join(GENDER_STRIPPERS) + r')\s*', re.IGNORECASE)
-    GENDER_SUFFIX_PATTERN = re.compile(r'\s+(' + '|'.join(GENDER_STRIPPERS) + r')\s*$', re.IGNORECASE)
-
-
-    for item in items:
-        # 1. Get required elements (Category, Title, Brand, Lifestyle, and Link)
-        category_element = item.find('g:google_product_category', NAMESPACES)
-        lifestyle_element = item.find('custom_label_0', NAMESPACES)
-        brand_element = item.find('custom_label_3', NAMESPACES)
-        title_element = item.find('g:title', NAMESPACES)
-        # Note: g:link is used here, assuming the feed structure is consistent
-        link_element = item.find('g:link', NAMESPACES) 
-        
-        # Helper to safely retrieve text, accounting for None and CDATA
-        get_text = lambda elem: (elem.text or "").strip() if elem is not None else ""
-
-        raw_category = get_text(category_element)
-        raw_lifestyle = get_text(lifestyle_element)
-        raw_brand = get_text(brand_element)
-        raw_title = get_text(title_element)
-        raw_link = get_text(link_element) 
-        
-        # 2. Apply Filtering Conditions
-        # A. Must contain "Street Shoes" in category
-        # B. Must be exactly "Lifestyle" in custom_label_0 (case insensitive)
-        is_street_shoe = TARGET_CATEGORY_PART in raw_category
-        is_lifestyle = raw_lifestyle.lower() == "lifestyle"
-        has_data = bool(raw_title) and bool(raw_brand) and bool(raw_link) 
-        
-        if is_street_shoe and is_lifestyle and has_data:
-            
+    # Stream the feed item by item instead of building the whole DOM up front.
+    # Items are filtered as they arrive and freed straight after.
+    context = ET.iterparse(xml_stream, events=('end',), **ITEM_EVENT_FILTER)
+    try:
+        for item in iter_feed_items(context):
+            item_count += 1
+
+            # 1. Read every child once, keyed by its resolved tag
+            fields = {child.tag: child.text for child in item}
+
+            # 2. Apply the cheap Filtering Conditions first, most items stop here
+            # A. Must contain "Street Shoes" in category
+            if target_category not in (fields.get(tag_category) or ""):
+                continue
+            # B. Must be exactly "Lifestyle" in custom_label_0 (case insensitive)
+            if (fields.get(tag_lifestyle) or "").strip().lower() != "lifestyle":
+                continue
+
+            # 3. Only matching items get their Title, Brand, and Link extracted
+            # .text may be None for empty elements; strip accounts for CDATA padding
+            raw_brand = (fields.get(tag_brand) or "").strip()
+            raw_title = (fields.get(tag_title) or "").strip()
+            # Note: g:link is used here, assuming the feed structure is consistent
+            raw_link = (fields.get(tag_link) or "").strip()
+            if not (raw_title and raw_brand and raw_link):
+                continue
+
             matched_count += 1
             
-            # --- 3. Normalization and Deduplication ---
+            # --- 4. Normalization and Deduplication ---
             
             # A. Brand Normalization: 'adidas originals' -> 'adidas'
-            normalized_brand = raw_brand.lower()
-            if normalized_brand == "adidas originals":
-                normalized_brand = "adidas"
+            brand_info = normalized_brands.get(raw_brand)
+            if brand_info is None:
+                normalized_brand = raw_brand.lower()
+                if normalized_brand == "adidas originals":
+                    normalized_brand = "adidas"
+                brand_info = normalized_brands[raw_brand] = (sys.intern(normalized_brand), normalized_brand.split())
+            normalized_brand, brand_tokens = brand_info
             
-            # B. Title Cleaning (lowercase, single spaces)
-            clean_title = ' '.join(raw_title.lower().split())
+            # B. Title Cleaning (lowercase, split into words)
+            # All cleaning below works on this word list; it is joined back only once
+            title_tokens = raw_title.lower().split()
 
             # C. Gender Prefix/Suffix Removal
-            final_title = GENDER_PREFIX_PATTERN.sub('', clean_title)
-            final_title = GENDER_SUFFIX_PATTERN.sub('', final_title).strip()
-            
-            # Re-clean to remove any double spaces left by stripping
-            final_title = ' '.join(final_title.split())
-            
+            while title_tokens and title_tokens[0] in gender_tokens:
+                del title_tokens[0]
+            while title_tokens and title_tokens[-1] in gender_tokens:
+                title_tokens.pop()
             
-            # D. Brand Redundancy Check 
-            
-            # 1. Check for standard redundant brand prefix (e.g., 'nike nike air max')
-            brand_prefix = normalized_brand + ' '
-            if final_title.startswith(brand_prefix):
-                final_title = final_title[len(brand_prefix):].strip()
-            
-            # 2. Re-clean to remove any double spaces left by stripping
-            final_title = ' '.join(final_title.split())
+            # D. Brand Redundancy Check: drop a repeated brand prefix (e.g., 'nike nike air max')
+            brand_len = len(brand_tokens)
+            if len(title_tokens) > brand_len and title_tokens[:brand_len] == brand_tokens:
+                del title_tokens[:brand_len]
+
+            final_title = ' '.join(title_tokens)
 
-            # --- 4. Final Output String Creation ---
+            # --- 5. Final Output String Creation ---
             
-            if normalized_brand == 'jordan' and 'air jordan' in final_title:
+            # 'air jordan ...' titles already name the brand; the trailing space keeps 'air jordans' out
+            if normalized_brand == 'jordan' and final_title.startswith('air jordan '):
                 output_string = final_title
             else:
                 output_string = f"{normalized_brand} {final_title}"
             
             # Use the final product string as the key to enforce uniqueness, storing the link
             unique_product_data[output_string] = raw_link
+    except ET.ParseError as e:
+        log.error("Error parsing XML: %s", e)
+        return []
+    except urllib3.exceptions.HTTPError as e:
+        log.error("Feed download interrupted: %s", e)
+        return []
 
-        elif is_street_shoe and has_data:
-             # This block logs items that meet the old criteria but fail the new 'Lifestyle' filter
-             pass 
+    root = context.root
+    log.debug("XML Parsed successfully. Root tag is: %s", root.tag)
+
+    # --- Namespace Discovery for Product Items (RSS/Atom) ---
+    default_namespace = root.tag[1:root.tag.index('}')] if root.tag.startswith('{') else None
+    if default_namespace:
+        log.debug("Default namespace: %s.", default_namespace)
+
+    # --- Check for successful item discovery ---
+    if not item_count:
+        log.warning("Could not find any product items using common paths (./item, ./entry, or qualified names).")
+        log.debug("Root Element Children (Snippet):")
+        for i, child in enumerate(root):
+            if i < 5:
+                log.debug("  Child %d Tag: %s", i + 1, child.tag)
+            else:
+                break
+        return []
+        
+    log.debug("Processed %d product items.", item_count)
 
     # Print the links in the requested "product [space] link" format
     print("\n=======================================================")
@@ -164,40 +205,38 @@ def extract_street_shoes_list(xml_content):
     print("(Product Name [space] Link)")
     print("=======================================================")
     
-    # Sort and prepare the final results list
-    sorted_product_strings = sorted(unique_product_data.keys())
-    final_output_list = []
+    # Sort the (product, link) pairs once; the dict has already removed duplicates
+    sorted_products = sorted(unique_product_data.items())
+    if sorted_products:
+        print('\n'.join(f" {link}" for _, link in sorted_products))
     
-    for product_string in sorted_product_strings:
-        link = unique_product_data[product_string]
-        # CHANGE HERE: Print the combined string
-        combined_output = f" {link}"
-        print(combined_output)
-        
-        # Keep only the product name for the file writing function
-        final_output_list.append(product_string)
-
+    # Keep only the product name for the file writing function
+    final_output_list = [product_string for product_string, _ in sorted_products]
 
-    print(f"\nDEBUG: Finished processing. Total items matched by category and lifestyle: {matched_count}.")
-    print(f"DEBUG: Final unique products extracted: {len(unique_product_data)}")
+    log.debug("Finished processing. Total items matched by category and lifestyle: %d.", matched_count)
+    log.debug("Final unique products extracted: %d", len(unique_product_data))
     
     # Return the product names for the file writing function
     return final_output_list
 
 def write_product_list(data_list, filename):
     """Writes the list of unique products to the specified file."""
-    print(f"\nWriting {len(data_list)} unique product names to {filename}...")
+    log.info("Writing %d unique product names to %s...", len(data_list), filename)
     
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            for line in data_list:
-                f.write(line + '\n')
-        print("SUCCESS: File created successfully.")
+        # One joined write instead of a write call per line
+        with open(filename, 'w', encoding='utf-8', buffering=1 << 16) as f:
+            f.write('\n'.join(data_list))
+            f.write('\n')
+        log.info("File created successfully.")
     except IOError as e:
-        print(f"FATAL ERROR: Error writing file: {e}")
+        log.error("Error writing file: %s", e)
 
 # --- Main Execution ---
 if __name__ == "__main__":
+    # DEBUG output is off by default; set LOG_LEVEL=DEBUG to see it
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    log.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
     xml_data = fetch_xml_data(XML_FEED_URL)
     
     if xml_data:
@@ -205,4 +244,4 @@ if __name__ == "__main__":
         if extracted_products:
             write_product_list(extracted_products, OUTPUT_FILENAME)
         else:
-            print("INFO: No products matched the filter, or extraction failed. Output file is empty.")
+            log.info("No products matched the filter, or extraction failed. Output file is empty.")
@@ -1,7 +1,22 @@
-import pandas as pd
+import csv
+import heapq
 import requests
-import xml.etree.ElementTree as ET
+import io
 import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Prefer the libxml2-backed parser, it is a drop-in for ElementTree here.
+# lxml can also drop every non-<item> iterparse event before it reaches Python.
+try:
+    from lxml import etree as ET
+    ITEM_EVENT_FILTER = {'tag': 'item'}
+except ImportError:
+    import xml.etree.ElementTree as ET
+    ITEM_EVENT_FILTER = {}
  
 # --- CONFIGURATION ---
 # This pulls from the 'env' section of your GitHub YAML
@@ -24,16 +39,45 @@ FEED_URLS = {
     'FI': 'https://backend.ballzy.eu/fi/amfeed/feed/download?id=103&file=cropink_fi.xml'
 }
 
+# One pooled session for every sheet and feed download, so repeated requests to
+# the same host (all four feeds live on backend.ballzy.eu) reuse the TLS connection.
+# Feeds are also cached on disk for an hour and shared with street_shoes_extractor,
+# which downloads the same EE feed; the revenue sheets are always fetched fresh.
+# The sheet CSV export redirects to googleusercontent.com, so that host is excluded too.
+try:
+    from requests_cache import CachedSession, DO_NOT_CACHE
+    SESSION = CachedSession('feed_cache', expire_after=3600,
+                            urls_expire_after={'docs.google.com': DO_NOT_CACHE,
+                                               '*.googleusercontent.com': DO_NOT_CACHE})
+    SESSION_CACHES = True
+except ImportError:
+    SESSION = requests.Session()
+    SESSION_CACHES = False
+# pool_maxsize leaves room for all country workers hitting backend.ballzy.eu at once;
+# http:// is mounted too so redirects through plain http keep the pooling and retries
+_adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16,
+                       max_retries=Retry(total=3, backoff_factor=0.3))
+SESSION.mount('https://', _adapter)
+SESSION.mount('http://', _adapter)
+
+# Google Merchant Center namespace, as resolved '{uri}local' tags so find() needs no prefix map
+G_NS = '{http://base.google.com/ns/1.0}'
+G_TITLE = G_NS + 'title'
+G_LINK = G_NS + 'link'
+
+# Acute accent and curly quotes all normalize to a plain apostrophe, in one pass
+_QUOTE_TRANS = str.maketrans({'´': "'", '’': "'", '‘': "'"})
+
 def clean_name(text):
     """Normalize text for matching."""
     if not text: return ""
-    return str(text).lower().strip().replace('´', "'").replace('’', "'")
+    return text.lower().strip().translate(_QUOTE_TRANS)
 
 def force_https_clean(url_text):
     """Aggressively strips whitespace and forces https."""
     if not url_text: return ""
     # Strip whitespace, newlines, and tabs often hidden in CDATA
-    clean_url = str(url_text).strip()
+    clean_url = url_text.strip()
     if clean_url.startswith("http://"):
         return clean_url.replace("http://", "https://", 1)
     elif not clean_url.startswith("https://") and "://" not in clean_url:
@@ -41,100 +85,152 @@ def force_https_clean(url_text):
         return "https://" + clean_url.lstrip("/")
     return clean_url
 
-def get_xml_feed_map(url):
+def response_body(response):
+    """Returns the body of a stream=True response as a binary file for the parsers."""
+    # requests-cache downloads and decodes the whole body itself to store it, and a gzip
+    # response.raw cannot be decoded a second time: parse that stored copy instead
+    if SESSION_CACHES:
+        return io.BytesIO(response.content)
+    response.raw.decode_content = True
+    # keep raw open at EOF so a text wrapper can finish; closing the response closes it
+    response.raw.auto_close = False
+    return response.raw
+
+def get_xml_feed_map(url, log=print):
     """Parses XML and maps cleaned g:title -> forced https g:link."""
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        root = ET.fromstring(response.content)
-        
-        feed_map = {}
-        # Google Merchant Center namespace
-        ns = {'g': 'http://base.google.com/ns/1.0'}
+        # stream=True: without requests-cache the parser reads the body as it downloads
+        # instead of it being buffered first; closing the response hands the connection
+        # back to the pool
+        with SESSION.get(url, timeout=30, stream=True) as response:
+            response.raise_for_status()
         
-        items = root.findall('.//item')
-        print(f"    [Debug] Found {len(items)} items in XML feed.")
-
-        for item in items:
-            # FIX: Use 'is not None' to avoid DeprecationWarning
-            title_node = item.find('g:title', ns)
-            if title_node is None:
-                title_node = item.find('title')
+            feed_map = {}
+            item_count = 0
+
+            # Stream the items instead of building the whole DOM, freeing each one once mapped
+            for _, item in ET.iterparse(response_body(response), events=('end',), **ITEM_EVENT_FILTER):
+                if item.tag != 'item':
+                    continue
+                item_count += 1
+
+                # FIX: Use 'is not None' to avoid DeprecationWarning
+                title_node = item.find(G_TITLE)
+                if title_node is None:
+                    title_node = item.find('title')
                 
-            link_node = item.find('g:link', ns)
-            if link_node is None:
-                link_node = item.find('link')
+                link_node = item.find(G_LINK)
+                if link_node is None:
+                    link_node = item.find('link')
                 
-            if title_node is not None and link_node is not None:
-                title_key = clean_name(title_node.text)
-                secure_link = force_https_clean(link_node.text)
+                if title_node is not None and link_node is not None:
+                    title_key = clean_name(title_node.text)
+                    secure_link = force_https_clean(link_node.text)
                 
-                if title_key and title_key not in feed_map:
-                    feed_map[title_key] = secure_link
+                    if title_key and title_key not in feed_map:
+                        feed_map[title_key] = secure_link
+
+                item.clear()
+                # lxml only: also drop the already processed siblings from the parent
+                if hasattr(item, 'getprevious'):
+                    while item.getprevious() is not None:
+                        del item.getparent()[0]
         
-        print(f"    [Debug] Mapped {len(feed_map)} unique titles from feed.")
-        return feed_map
+            log(f"    [Debug] Found {item_count} items in XML feed.")
+            log(f"    [Debug] Mapped {len(feed_map)} unique titles from feed.")
+            return feed_map
     except Exception as e:
-        print(f"    [!] XML Error: {e}")
+        log(f"    [!] XML Error: {e}")
         return {}
 
 def process_country_feed(country, gid):
-    print(f"\n--- Processing {country} ---")
-    
-    sheet_url = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/export?format=csv&gid={gid}"
+    """Builds one country's page feed and prints its log lines as a single block,
+    so countries processed in parallel don't interleave their output."""
+    lines = [f"\n--- Processing {country} ---"]
     try:
-        df = pd.read_csv(sheet_url)
-    except Exception as e:
-        print(f"   [!] Sheet Download failed: {e}")
-        return
+        build_country_feed(country, gid, lines.append)
+    finally:
+        print('\n'.join(lines))
 
+def get_sheet_revenue(url, log=print):
+    """Downloads a revenue sheet tab as CSV and sums 'Item revenue' per 'Corrected name'."""
     name_col = 'Corrected name'
     rev_col = 'Item revenue'
+    try:
+        # stream=True: without requests-cache rows are parsed as the body downloads
+        with SESSION.get(url, timeout=30, stream=True) as response:
+            response.raise_for_status()
+            rows = csv.reader(io.TextIOWrapper(response_body(response), encoding='utf-8-sig', newline=''))
+            header = next(rows, [])
 
-    if name_col not in df.columns or rev_col not in df.columns:
-        print(f"   [!] Headers missing. Found: {list(df.columns)}")
-        return
+            if name_col not in header or rev_col not in header:
+                log(f"   [!] Headers missing. Found: {header}")
+                return None
+
+            # Rows stay plain lists: only the two used columns are read, by position
+            name_idx = header.index(name_col)
+            rev_idx = header.index(rev_col)
+            min_row_len = max(name_idx, rev_idx) + 1
+
+            # Sum revenue per product; unparseable or empty revenue counts as 0
+            revenue_by_name = defaultdict(float)
+            for row in rows:
+                if len(row) < min_row_len:
+                    continue
+                try:
+                    revenue = float(row[rev_idx])
+                except ValueError:
+                    revenue = 0.0
+                if revenue != revenue:  # NaN
+                    revenue = 0.0
+                revenue_by_name[row[name_idx]] += revenue
+            return revenue_by_name
+    except Exception as e:
+        log(f"   [!] Sheet Download failed: {e}")
+        return None
 
-    df[rev_col] = pd.to_numeric(df[rev_col], errors='coerce').fillna(0)
-    unique_products = df.groupby(name_col)[rev_col].sum().reset_index()
-    unique_products = unique_products.sort_values(by=rev_col, ascending=False)
+def build_country_feed(country, gid, log):
+    sheet_url = f"https://docs.google.com/spreadsheets/d/{SHEET_ID}/export?format=csv&gid={gid}"
+    revenue_by_name = get_sheet_revenue(sheet_url, log)
+    if revenue_by_name is None:
+        return
     
-    feed_map = get_xml_feed_map(FEED_URLS[country])
-    page_feed_results = []
-    seen_urls = set()
-
-    for _, row in unique_products.iterrows():
-        if len(page_feed_results) >= 50:
-            break
-            
-        sheet_name_clean = clean_name(row[name_col])
-        if sheet_name_clean in feed_map:
-            match_url = feed_map[sheet_name_clean]
-            if match_url not in seen_urls:
-                page_feed_results.append({
-                    'Page URL': match_url,
-                    'Custom label': f'Top50_{country}'
-                })
-                seen_urls.add(match_url)
-
-    if page_feed_results:
+    feed_map = get_xml_feed_map(FEED_URLS[country], log)
+
+    # Join the sheet products to the feed on the cleaned name. A page ranks by
+    # its best-selling sheet name
+    page_revenue = {}
+    for name, revenue in revenue_by_name.items():
+        match_url = feed_map.get(clean_name(name))
+        if match_url is not None and revenue > page_revenue.get(match_url, float('-inf')):
+            page_revenue[match_url] = revenue
+
+    # heapq.nlargest only keeps a 50-item heap instead of sorting every page
+    top_pages = heapq.nlargest(50, page_revenue.items(), key=itemgetter(1))
+
+    if top_pages:
         # LOGGING CHECK: Print the first URL to verify HTTPS in GitHub logs
-        print(f"   [Log Check] First URL: {page_feed_results[0]['Page URL']}")
+        log(f"   [Log Check] First URL: {top_pages[0][0]}")
         
-        final_df = pd.DataFrame(page_feed_results)
         filename = f"{country}_page_feed.csv"
-        final_df.to_csv(filename, index=False)
-        print(f"   [Done] {filename} saved with {len(page_feed_results)} items.")
+        custom_label = f'Top50_{country}'
+        with open(filename, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(['Page URL', 'Custom label'])
+            writer.writerows((url, custom_label) for url, _ in top_pages)
+        log(f"   [Done] {filename} saved with {len(top_pages)} items.")
     else:
-        print(f"   [!] No matches found for {country}.")
+        log(f"   [!] No matches found for {country}.")
 
 def main():
     if SHEET_ID == 'PASTE_YOUR_DEFAULT_ID_HERE' and 'GOOGLE_SHEET_ID' not in os.environ:
         print("Error: Missing GOOGLE_SHEET_ID.")
         return
         
-    for country, gid in COUNTRY_GIDS.items():
-        process_country_feed(country, gid)
+    # Each country is two network-bound downloads, so run them side by side.
+    # All workers share SESSION's connection pool.
+    with ThreadPoolExecutor(max_workers=len(COUNTRY_GIDS)) as executor:
+        list(executor.map(process_country_feed, COUNTRY_GIDS.keys(), COUNTRY_GIDS.values()))
 
 if __name__ == "__main__":
     main()
@@ -1,149 +1,252 @@
+import io
 import requests
-import xml.etree.ElementTree as ET
-import pandas as pd
-import re
+import urllib3
 import os
 import csv
-  
-def transform_cropink_to_google_ads_csv(cropink_url, output_csv_base="google_ads_feed"):
+from contextlib import ExitStack
+
+# lxml (libxml2) parses much faster than the stdlib ElementTree and exposes the
+# same API; with lxml, iterparse also hands only the <item> elements to Python.
+try:
+    from lxml import etree as ET
+    ITEM_EVENT_FILTER = {'tag': 'item'}
+except ImportError:
+    import xml.etree.ElementTree as ET
+    ITEM_EVENT_FILTER = {}
+
+# One session for the feed download, cached on disk (feed_cache.sqlite) for an hour.
+# street_shoes_extractor runs next in the workflow on the same EE feed and reuses it.
+# requests already asks for gzip/deflate (and br/zstd when their decoders are installed).
+try:
+    from requests_cache import CachedSession
+    SESSION = CachedSession('feed_cache', expire_after=3600)
+    SESSION_CACHES = True
+except ImportError:
+    SESSION = requests.Session()
+    SESSION_CACHES = False
+
+# Google Merchant Center namespace, as resolved '{uri}local' tags so find() needs no prefix map
+G_NS = '{http://base.google.com/ns/1.0}'
+G_ID = G_NS + 'id'
+G_TITLE = G_NS + 'title'
+G_LINK = G_NS + 'link'
+G_IMAGE_LINK = G_NS + 'image_link'
+G_DESCRIPTION = G_NS + 'description'
+G_PRODUCT_CATEGORY = G_NS + 'google_product_category'
+G_PRODUCT_TYPE = G_NS + 'product_type'
+G_PRICE = G_NS + 'price'
+G_SALE_PRICE = G_NS + 'sale_price'
+G_BRAND = G_NS + 'brand'
+G_COLOR = G_NS + 'color'
+
+# Column order of the Google Ads Business Data CSVs
+GOOGLE_ADS_COLUMNS = [
+    'ID', 'ID2', 'Item title', 'Final URL', 'Image URL', 'Item subtitle',
+    'Item description', 'Item category', 'Price', 'Sale price',
+    'Contextual keywords', 'Item address', 'Tracking template',
+    'Custom parameter', 'Final mobile URL', 'Android app link',
+    'iOS app link', 'iOS app store ID', 'Formatted price', 'Formatted sale price'
+]
+
+# Rows are plain lists in GOOGLE_ADS_COLUMNS order; position of each column
+COLUMN_INDEX = {column: i for i, column in enumerate(GOOGLE_ADS_COLUMNS)}
+ITEM_CATEGORY_INDEX = COLUMN_INDEX['Item category']
+KEYWORDS_INDEX = COLUMN_INDEX['Contextual keywords']
+
+# Item fields copied as they are into a Google Ads column
+G_TEXT_COLUMNS = (
+    (G_ID, COLUMN_INDEX['ID']),
+    (G_TITLE, COLUMN_INDEX['Item title']),
+    (G_LINK, COLUMN_INDEX['Final URL']),
+    (G_IMAGE_LINK, COLUMN_INDEX['Image URL']),
+    (G_DESCRIPTION, COLUMN_INDEX['Item description']),
+)
+
+# Price fields, normalized by parse_price
+G_PRICE_COLUMNS = (
+    (G_PRICE, COLUMN_INDEX['Price']),
+    (G_SALE_PRICE, COLUMN_INDEX['Sale price']),
+)
+
+# Cropink's own (un-namespaced) labels, custom_label_0 holds the sport category
+CUSTOM_LABELS = ('custom_label_0', 'custom_label_1', 'custom_label_2', 'custom_label_3', 'custom_label_4')
+
+# custom_label_0 values that name a category exactly
+CATEGORY_LABELS = {'basketball': 'basketball', 'lifestyle': 'lifestyle'}
+
+# Fields joined into 'Contextual keywords', in this order
+KEYWORD_TAGS = (G_BRAND, G_COLOR) + CUSTOM_LABELS
+
+# Characters allowed in the numeric part of a price
+_PRICE_CHARS = '0123456789.'
+
+def parse_price(price_text):
+    """Formats a price/sale price as 'VALUE CUR'; other text is returned as is."""
+    if price_text:
+        price_text = price_text.strip()
+        # A number followed by a 3-letter currency code, e.g. '129.99 EUR' or '129.99eur'
+        currency_code = price_text[-3:]
+        price_value = price_text[:-3].rstrip()
+        if (price_value and not price_value.strip(_PRICE_CHARS)
+                and currency_code.isascii() and currency_code.isalpha()):
+            return f"{price_value} {currency_code.upper()}"
+        return price_text
+    return ''
+
+def response_body(response):
+    """Returns the body of a stream=True response as a binary file for the parser."""
+    # requests-cache downloads and decodes the whole body itself to store it, and a gzip
+    # response.raw cannot be decoded a second time: parse that stored copy instead
+    if SESSION_CACHES:
+        return io.BytesIO(response.content)
+    response.raw.decode_content = True
+    return response.raw
+
+def map_cropink_item(item, split=True):
+    """Maps one Cropink <item> to its category key and Google Ads row.
+
+    Returns (None, None) for items that are neither basketball nor lifestyle.
+    With split=False every item is mapped, under the category key 'all'.
+    """
+    # Read every child once, keyed by its resolved tag, instead of a find() per field
+    fields = {child.tag: child.text for child in item if child.text}
+
+    if split:
+        # Check the custom_label_0 to determine the category
+        category_key = None
+        label_text = fields.get('custom_label_0')
+        if label_text:
+            label_text = label_text.strip().lower()
+            # Most labels are exactly the category name; only others need the substring checks
+            category_key = CATEGORY_LABELS.get(label_text)
+            if category_key is None:
+                if "basketball" in label_text:
+                    category_key = 'basketball'
+                elif "lifestyle" in label_text:
+                    category_key = 'lifestyle'
+
+        if not category_key:
+            return None, None
+    else:
+        category_key = 'all'
+
+    # Start from an all-empty row and fill in only the columns the item has
+    product_data = [''] * len(GOOGLE_ADS_COLUMNS)
+
+    # --- Mapping Logic ---
+    for tag, index in G_TEXT_COLUMNS:
+        text = fields.get(tag)
+        if text:
+            product_data[index] = text.strip()
+
+    # g:google_product_category, or g:product_type when it is missing
+    category_text = fields.get(G_PRODUCT_CATEGORY) or fields.get(G_PRODUCT_TYPE)
+    if category_text:
+        product_data[ITEM_CATEGORY_INDEX] = category_text.strip()
+
+    for tag, index in G_PRICE_COLUMNS:
+        text = fields.get(tag)
+        if text:
+            product_data[index] = parse_price(text)
+
+    # Whitespace-only values are left out of the keywords
+    keywords = []
+    for tag in KEYWORD_TAGS:
+        text = fields.get(tag)
+        if text:
+            text = text.strip()
+            if text:
+                keywords.append(text)
+
+    if keywords:
+        product_data[KEYWORDS_INDEX] = ";".join(keywords)
+
+    return category_key, product_data
+
+def transform_cropink_to_google_ads_csv(cropink_url, output_csv_base="google_ads_feed", split=True):
     """
     Fetches the Cropink XML feed, transforms it into Google Ads Business Data
     compatible CSVs for 'Basketball' and 'Lifestyle' categories, and saves them
     to separate files.
+    With split=False every item is saved, uncategorized, to a single CSV file.
     """
     print(f"Attempting to fetch Cropink feed from: {cropink_url}")
     try:
-        response = requests.get(cropink_url)
+        # stream=True: without requests-cache the parser reads the body as it downloads
+        response = SESSION.get(cropink_url, timeout=45, stream=True)
         response.raise_for_status()
-        cropink_data = response.text
         print("Successfully fetched Cropink feed.")
     except requests.exceptions.RequestException as e:
         print(f"Error fetching Cropink feed: {e}")
         return False
 
+    # Rows are written to the CSVs while the feed is parsed, nothing is collected first.
+    # A category's file is opened on its first product, so an empty category still gets
+    # no file, and it is written as .tmp until the whole feed has parsed successfully.
+    if split:
+        output_csv_files = {category: f"{output_csv_base}_{category}.csv"
+                            for category in ('basketball', 'lifestyle')}
+    else:
+        output_csv_files = {'all': f"{output_csv_base}.csv"}
+    writers = {}
+    tmp_files = {}
+    row_counts = dict.fromkeys(output_csv_files, 0)
+    parsed = False
+
     print("Attempting to parse Cropink XML.")
     try:
-        root = ET.fromstring(cropink_data)
+        with ExitStack() as open_files:
+            # Stream the items instead of building the whole DOM, freeing each one once mapped
+            for _, item in ET.iterparse(response_body(response), events=('end',), **ITEM_EVENT_FILTER):
+                if item.tag != 'item':
+                    continue
+                category_key, product_data = map_cropink_item(item, split)
+                if category_key:
+                    writer = writers.get(category_key)
+                    if writer is None:
+                        output_csv_file = output_csv_files[category_key]
+                        print(f"Attempting to save {category_key.capitalize()} data to {output_csv_file}")
+                        tmp_file = output_csv_file + '.tmp'
+                        f = open_files.enter_context(
+                            open(tmp_file, 'w', encoding='utf-8', newline='', buffering=1 << 20))
+                        tmp_files[category_key] = tmp_file
+                        writer = writers[category_key] = csv.writer(f, quoting=csv.QUOTE_MINIMAL,
+                                                                    lineterminator='\n')
+                        writer.writerow(GOOGLE_ADS_COLUMNS)
+                    writer.writerow(product_data)
+                    row_counts[category_key] += 1
+
+                item.clear()
+                # lxml only: also drop the already processed siblings from the parent
+                if hasattr(item, 'getprevious'):
+                    while item.getprevious() is not None:
+                        del item.getparent()[0]
         print("Successfully parsed Cropink XML.")
+        parsed = True
     except ET.ParseError as e:
         print(f"Error parsing Cropink XML: {e}")
         return False
+    except urllib3.exceptions.HTTPError as e:
+        print(f"Error fetching Cropink feed: {e}")
+        return False
+    except IOError as e:
+        print(f"Error saving CSV file: {e}")
+        return False
+    finally:
+        response.close()
+        # A failed run leaves the previous CSVs untouched
+        if not parsed:
+            for tmp_file in tmp_files.values():
+                os.remove(tmp_file)
 
-    products_for_google_ads = {
-        'basketball': [],
-        'lifestyle': []
-    }
-
-    # Helper function to parse price/sale price with currency
-    def parse_price(price_element):
-        if price_element is not None and price_element.text:
-            price_text = price_element.text.strip()
-            # Simple check for a number followed by a currency code
-            match = re.match(r'([\d.]+)\s*([A-Z]{3})$', price_text, re.IGNORECASE)
-            if match:
-                price_value = match.group(1)
-                currency_code = match.group(2).upper()
-                return f"{price_value} {currency_code}"
-            return price_text
-        return ''
-
-    # Iterate through each <item> element
-    namespaces = {'g': 'http://base.google.com/ns/1.0'}
-    for item in root.findall(".//item"):
-        # Check the custom_label_0 to determine the category
-        custom_label_0 = item.find('custom_label_0')
-        category_key = None
-        if custom_label_0 is not None and custom_label_0.text:
-            label_text = custom_label_0.text.strip().lower()
-            if "basketball" in label_text:
-                category_key = 'basketball'
-            elif "lifestyle" in label_text:
-                category_key = 'lifestyle'
-
-        if category_key:
-            # Initialize a dictionary for the current product's Google Ads data
-            product_data = {
-                'ID': '', 'ID2': '', 'Item title': '', 'Final URL': '', 'Image URL': '',
-                'Item subtitle': '', 'Item description': '', 'Item category': '',
-                'Price': '', 'Sale price': '', 'Contextual keywords': '',
-                'Item address': '', 'Tracking template': '', 'Custom parameter': '',
-                'Final mobile URL': '', 'Android app link': '', 'iOS app link': '',
-                'iOS app store ID': '', 'Formatted price': '', 'Formatted sale price': ''
-            }
-
-            # --- Mapping Logic ---
-            g_id = item.find('g:id', namespaces=namespaces)
-            if g_id is not None and g_id.text:
-                product_data['ID'] = g_id.text.strip()
-
-            g_title = item.find('g:title', namespaces=namespaces)
-            if g_title is not None and g_title.text:
-                product_data['Item title'] = g_title.text.strip()
-
-            g_link = item.find('g:link', namespaces=namespaces)
-            if g_link is not None and g_link.text:
-                product_data['Final URL'] = g_link.text.strip()
-
-            g_image_link = item.find('g:image_link', namespaces=namespaces)
-            if g_image_link is not None and g_image_link.text:
-                product_data['Image URL'] = g_image_link.text.strip()
-
-            g_description = item.find('g:description', namespaces=namespaces)
-            if g_description is not None and g_description.text:
-                product_data['Item description'] = g_description.text.strip()
-
-            g_product_category = item.find('g:google_product_category', namespaces=namespaces)
-            g_product_type = item.find('g:product_type', namespaces=namespaces)
-            if g_product_category is not None and g_product_category.text:
-                product_data['Item category'] = g_product_category.text.strip()
-            elif g_product_type is not None and g_product_type.text:
-                product_data['Item category'] = g_product_type.text.strip()
-
-            g_price = item.find('g:price', namespaces=namespaces)
-            product_data['Price'] = parse_price(g_price)
-
-            g_sale_price = item.find('g:sale_price', namespaces=namespaces)
-            product_data['Sale price'] = parse_price(g_sale_price)
-
-            keywords = []
-            g_brand = item.find('g:brand', namespaces=namespaces)
-            if g_brand is not None and g_brand.text:
-                keywords.append(g_brand.text.strip())
-
-            g_color = item.find('g:color', namespaces=namespaces)
-            if g_color is not None and g_color.text:
-                keywords.append(g_color.text.strip())
-
-            for i in range(5):
-                custom_label = item.find(f'custom_label_{i}')
-                if custom_label is not None and custom_label.text:
-                    keywords.append(custom_label.text.strip())
-
-            if keywords:
-                product_data['Contextual keywords'] = ";".join(filter(None, keywords))
-
-            products_for_google_ads[category_key].append(product_data)
-
-    # --- Save to separate CSV files ---
-    google_ads_columns_order = [
-        'ID', 'ID2', 'Item title', 'Final URL', 'Image URL', 'Item subtitle',
-        'Item description', 'Item category', 'Price', 'Sale price',
-        'Contextual keywords', 'Item address', 'Tracking template',
-        'Custom parameter', 'Final mobile URL', 'Android app link',
-        'iOS app link', 'iOS app store ID', 'Formatted price', 'Formatted sale price'
-    ]
- 
+    # --- Move the finished CSV files into place ---
     success = True
-    for category, product_list in products_for_google_ads.items():
-        if product_list:
-            output_csv_file = f"{output_csv_base}_{category}.csv"
-            df = pd.DataFrame(product_list)
-            df = df.reindex(columns=google_ads_columns_order)
-
-            print(f"Attempting to save {category.capitalize()} data to {output_csv_file}")
+    for category, row_count in row_counts.items():
+        if row_count:
+            output_csv_file = output_csv_files[category]
             try:
-                df.to_csv(output_csv_file, index=False, encoding='utf-8', sep=',', doublequote=True, quoting=csv.QUOTE_ALL)
-                print(f"Successfully transformed feed and saved to {output_csv_file}")
+                os.replace(tmp_files[category], output_csv_file)
+                print(f"Successfully transformed feed and saved {row_count} products to {output_csv_file}")
             except IOError as e:
                 print(f"Error saving CSV file: {e}")
                 success = False
@@ -155,8 +258,10 @@ def transform_cropink_to_google_ads_csv(cropink_url, output_csv_base="google_ads
 if __name__ == "__main__":
     cropink_feed_url = os.environ.get('CROPINK_FEED_URL', "https://backend.ballzy.eu/et/amfeed/feed/download?id=102&file=cropink_et.xml")
     output_csv_base = os.environ.get('OUTPUT_CSV_BASE', "google_ads_feed")
+    # SPLIT_BY_CATEGORY=0 writes every item to a single {OUTPUT_CSV_BASE}.csv instead
+    split = os.environ.get('SPLIT_BY_CATEGORY', '1') != '0'
 
-    success = transform_cropink_to_google_ads_csv(cropink_feed_url, output_csv_base)
+    success = transform_cropink_to_google_ads_csv(cropink_feed_url, output_csv_base, split)
     if success:
         print("CSV generation process completed successfully.")
     else: